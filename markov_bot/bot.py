@@ -1,16 +1,31 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
 from datetime import date, datetime, timedelta
+from functools import wraps
+from weakref import WeakValueDictionary
+from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
 
-from telegram import Update
+from telegram import Message, Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
-from markov_bot.config import load_settings
-from markov_bot.domain import TaskStatus
+from markov_bot.config import Settings, load_settings
+from markov_bot.domain import TaskAssignment, TaskEvent, TaskStatus
 from markov_bot.services import DEFAULT_RULES, TaskService
 from markov_bot.storage import Storage
 
+logger = logging.getLogger(__name__)
+
+PLAN_QUEUE_SIZE = 256
+PLAN_WORKER_POLL_INTERVAL = 1.0
+PLAN_FAILED_TEXT = "Не удалось подготовить задания. Повтори /day."
+EVENT_BATCH_WINDOW = 0.05
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
+
 
 def _today(timezone: str) -> date:
     return datetime.now(tz=ZoneInfo(timezone)).date()
@@ -22,12 +37,132 @@ def _parse_assignment_id(args: list[str]) -> str | None:
     return args[0]
 
 
+def _format_plan(assignments: list[TaskAssignment]) -> str:
+    lines = ["Задания на сегодня:"]
+    for item in assignments:
+        lines.append(f"{item.assignment_id} | {item.skill.value} | {item.title}")
+    return "\n".join(lines)
+
+
+def _per_chat(handler: Handler) -> Handler:
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat = update.effective_chat
+        if not chat:
+            await handler(update, context)
+            return
+        locks: WeakValueDictionary[int, asyncio.Lock] = context.bot_data["chat_locks"]
+        lock = locks.get(chat.id)
+        if lock is None:
+            lock = asyncio.Lock()
+            locks[chat.id] = lock
+        async with lock:
+            await handler(update, context)
+
+    return wrapper
+
+
+async def _edit_message(message: Message, text: str) -> None:
+    try:
+        await message.edit_text(text)
+    except Exception:
+        logger.exception("Failed to edit message %s", message.message_id)
+
+
+async def _send_edit(app: Application, message: Message, text: str) -> None:
+    if app.running:
+        app.create_task(_edit_message(message, text))
+    else:
+        await _edit_message(message, text)
+
+
+async def _plan_worker(app: Application) -> None:
+    service: TaskService = app.bot_data["service"]
+    queue: asyncio.Queue[tuple[int, date, Message]] = app.bot_data["plan_queue"]
+    while app.running or not queue.empty():
+        try:
+            user_id, date_value, message = await asyncio.wait_for(
+                queue.get(), PLAN_WORKER_POLL_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            continue
+        try:
+            assignments = await asyncio.to_thread(
+                service.storage.list_assignments_for_date, user_id, date_value
+            )
+            if not assignments:
+                plan = await asyncio.to_thread(
+                    service.generate_daily_plan, user_id, date_value, DEFAULT_RULES
+                )
+                assignments = list(plan.assignments)
+        except Exception:
+            logger.exception("Failed to build daily plan for user %s", user_id)
+            await _send_edit(app, message, PLAN_FAILED_TEXT)
+        else:
+            await _send_edit(app, message, _format_plan(assignments))
+        finally:
+            queue.task_done()
+
+
+def _ensure_plan_worker(app: Application) -> None:
+    worker: asyncio.Task[None] | None = app.bot_data.get("plan_worker")
+    if worker is None or worker.done():
+        app.bot_data["plan_worker"] = app.create_task(_plan_worker(app))
+
+
+async def _flush_events(bot_data: dict) -> None:
+    await asyncio.sleep(EVENT_BATCH_WINDOW)
+    pending: list[tuple[TaskEvent, asyncio.Future[bool]]] = bot_data["event_batch"]
+    bot_data["event_batch"] = []
+    service: TaskService = bot_data["service"]
+    try:
+        results = await asyncio.to_thread(service.record_events, [event for event, _ in pending])
+    except Exception:
+        logger.exception("Batch of %s events failed, retrying one by one", len(pending))
+        for event, future in pending:
+            try:
+                [accepted] = await asyncio.to_thread(service.record_events, [event])
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+            else:
+                if not future.done():
+                    future.set_result(accepted)
+        return
+    for (_, future), accepted in zip(pending, results):
+        if not future.done():
+            future.set_result(accepted)
+
+
+async def _record_event(bot_data: dict, event: TaskEvent) -> bool:
+    batch: list[tuple[TaskEvent, asyncio.Future[bool]]] = bot_data["event_batch"]
+    if not batch:
+        flushes: set[asyncio.Task[None]] = bot_data["event_flushes"]
+        flush = asyncio.create_task(_flush_events(bot_data))
+        flushes.add(flush)
+        flush.add_done_callback(flushes.discard)
+    future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+    batch.append((event, future))
+    return await future
+
+
+async def _post_stop(app: Application) -> None:
+    queue: asyncio.Queue[tuple[int, date, Message]] = app.bot_data["plan_queue"]
+    while not queue.empty():
+        _, _, message = queue.get_nowait()
+        await _edit_message(message, PLAN_FAILED_TEXT)
+        queue.task_done()
+    await asyncio.gather(*app.bot_data["event_flushes"])
+    service: TaskService = app.bot_data["service"]
+    service.storage.close()
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     if not user:
         return
     service: TaskService = context.bot_data["service"]
-    service.storage.ensure_user(user.id)
+    await asyncio.to_thread(service.storage.ensure_user, user.id)
     await update.message.reply_text(
         "Регистрация завершена. Дальше только факты. Используй /day для заданий."
     )
@@ -39,14 +174,15 @@ async def day(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     service: TaskService = context.bot_data["service"]
     date_value = _today(context.bot_data["timezone"])
-    assignments = service.storage.list_assignments_for_date(user.id, date_value)
-    if not assignments:
-        plan = service.generate_daily_plan(user.id, date_value, DEFAULT_RULES)
-        assignments = list(plan.assignments)
-    lines = ["Задания на сегодня:"]
-    for item in assignments:
-        lines.append(f"{item.assignment_id} | {item.skill.value} | {item.title}")
-    await update.message.reply_text("\n".join(lines))
+    assignments = await asyncio.to_thread(
+        service.storage.list_assignments_for_date, user.id, date_value
+    )
+    if assignments:
+        await update.message.reply_text(_format_plan(assignments))
+        return
+    message = await update.message.reply_text("Готовлю задания...")
+    _ensure_plan_worker(context.application)
+    await context.bot_data["plan_queue"].put((user.id, date_value, message))
 
 
 async def done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -58,11 +194,10 @@ async def done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Укажи ID задания: /done <task_id>")
         return
     service: TaskService = context.bot_data["service"]
-    assignment = service.storage.fetch_assignment(assignment_id)
-    if not assignment or assignment.user_id != user.id:
+    event = service.new_event(user.id, assignment_id, TaskStatus.DONE)
+    if not await _record_event(context.bot_data, event):
         await update.message.reply_text("Задание не найдено.")
         return
-    service.record_result(user.id, assignment_id, TaskStatus.DONE)
     await update.message.reply_text("Зафиксировано: выполнено.")
 
 
@@ -75,11 +210,10 @@ async def fail(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Укажи ID задания: /fail <task_id>")
         return
     service: TaskService = context.bot_data["service"]
-    assignment = service.storage.fetch_assignment(assignment_id)
-    if not assignment or assignment.user_id != user.id:
+    event = service.new_event(user.id, assignment_id, TaskStatus.FAILED)
+    if not await _record_event(context.bot_data, event):
         await update.message.reply_text("Задание не найдено.")
         return
-    service.record_result(user.id, assignment_id, TaskStatus.FAILED)
     await update.message.reply_text("Зафиксировано: провал.")
 
 
@@ -89,7 +223,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     service: TaskService = context.bot_data["service"]
     date_value = _today(context.bot_data["timezone"])
-    summary = service.daily_summary(user.id, date_value)
+    summary = await asyncio.to_thread(service.daily_summary, user.id, date_value)
     await update.message.reply_text(
         f"День {summary.date_value.isoformat()}: {summary.done}/{summary.assigned} выполнено, {summary.failed} провалено."
     )
@@ -102,7 +236,7 @@ async def week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     service: TaskService = context.bot_data["service"]
     today = _today(context.bot_data["timezone"])
     week_start = today - timedelta(days=today.weekday())
-    summary = service.weekly_summary(user.id, week_start)
+    summary = await asyncio.to_thread(service.weekly_summary, user.id, week_start)
     adjustment = service.weekly_adjustment(summary)
     await update.message.reply_text(
         "\n".join(
@@ -124,7 +258,9 @@ async def month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     service: TaskService = context.bot_data["service"]
     today = _today(context.bot_data["timezone"])
     month_start = date(today.year, today.month, 1)
-    summary = service.monthly_summary(user.id, month_start, DEFAULT_RULES.level)
+    summary = await asyncio.to_thread(
+        service.monthly_summary, user.id, month_start, DEFAULT_RULES.level
+    )
     await update.message.reply_text(
         "\n".join(
             [
@@ -138,28 +274,58 @@ async def month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
-def build_app() -> Application:
-    settings = load_settings()
+def _install_uvloop() -> None:
+    try:
+        import uvloop
+    except ImportError:
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+def build_app(settings: Settings | None = None) -> Application:
+    if settings is None:
+        settings = load_settings()
     storage = Storage(settings.db_path)
     service = TaskService(storage)
     service.seed_templates()
-    app = Application.builder().token(settings.token).build()
+    app = (
+        Application.builder()
+        .token(settings.token)
+        .concurrent_updates(True)
+        .post_stop(_post_stop)
+        .build()
+    )
     app.bot_data["service"] = service
+    app.bot_data["plan_queue"] = asyncio.Queue(maxsize=PLAN_QUEUE_SIZE)
+    app.bot_data["chat_locks"] = WeakValueDictionary()
+    app.bot_data["event_batch"] = []
+    app.bot_data["event_flushes"] = set()
     app.bot_data["timezone"] = settings.timezone
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("day", day))
-    app.add_handler(CommandHandler("done", done))
-    app.add_handler(CommandHandler("fail", fail))
-    app.add_handler(CommandHandler("status", status))
-    app.add_handler(CommandHandler("week", week))
-    app.add_handler(CommandHandler("month", month))
+    app.add_handler(CommandHandler("start", _per_chat(start)))
+    app.add_handler(CommandHandler("day", _per_chat(day)))
+    app.add_handler(CommandHandler("done", _per_chat(done)))
+    app.add_handler(CommandHandler("fail", _per_chat(fail)))
+    app.add_handler(CommandHandler("status", _per_chat(status)))
+    app.add_handler(CommandHandler("week", _per_chat(week)))
+    app.add_handler(CommandHandler("month", _per_chat(month)))
     return app
 
 
 def main() -> None:
-    app = build_app()
-    app.run_polling()
+    _install_uvloop()
+    settings = load_settings()
+    app = build_app(settings)
+    if settings.webhook_url:
+        app.run_webhook(
+            listen=settings.webhook_listen,
+            port=settings.webhook_port,
+            url_path=urlparse(settings.webhook_url).path,
+            webhook_url=settings.webhook_url,
+            secret_token=settings.webhook_secret,
+        )
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
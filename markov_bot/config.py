@@ -9,6 +9,10 @@ class Settings:
     token: str
     db_path: str
     timezone: str
+    webhook_url: str | None = None
+    webhook_secret: str | None = None
+    webhook_listen: str = "0.0.0.0"
+    webhook_port: int = 8443
 
 
 def load_settings() -> Settings:
@@ -17,4 +21,18 @@ def load_settings() -> Settings:
         raise RuntimeError("MARKOV_TELEGRAM_TOKEN is required")
     db_path = os.getenv("MARKOV_DB_PATH", "markov.db")
     timezone = os.getenv("MARKOV_TIMEZONE", "Europe/Moscow")
-    return Settings(token=token, db_path=db_path, timezone=timezone)
+    webhook_url = os.getenv("MARKOV_WEBHOOK_URL") or None
+    webhook_secret = os.getenv("MARKOV_WEBHOOK_SECRET") or None
+    if webhook_url and not webhook_secret:
+        raise RuntimeError("MARKOV_WEBHOOK_SECRET is required when MARKOV_WEBHOOK_URL is set")
+    webhook_listen = os.getenv("MARKOV_WEBHOOK_LISTEN") or "0.0.0.0"
+    webhook_port = int(os.getenv("MARKOV_WEBHOOK_PORT") or "8443")
+    return Settings(
+        token=token,
+        db_path=db_path,
+        timezone=timezone,
+        webhook_url=webhook_url,
+        webhook_secret=webhook_secret,
+        webhook_listen=webhook_listen,
+        webhook_port=webhook_port,
+    )
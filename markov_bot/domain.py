@@ -21,7 +21,11 @@ class TaskStatus(str, Enum):
     FAILED = "failed"
 
 
-@dataclass(frozen=True)
+SKILL_BY_VALUE: dict[str, Skill] = {skill.value: skill for skill in Skill}
+STATUS_BY_VALUE: dict[str, TaskStatus] = {status.value: status for status in TaskStatus}
+
+
+@dataclass(frozen=True, slots=True)
 class TaskTemplate:
     template_id: str
     skill: Skill
@@ -30,7 +34,7 @@ class TaskTemplate:
     max_minutes: int
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TaskAssignment:
     assignment_id: str
     user_id: int
@@ -41,7 +45,7 @@ class TaskAssignment:
     status: TaskStatus = TaskStatus.ASSIGNED
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TaskEvent:
     event_id: str
     assignment_id: str
@@ -51,7 +55,7 @@ class TaskEvent:
     note: str | None = None
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class DaySummary:
     date_value: date
     assigned: int
@@ -59,7 +63,7 @@ class DaySummary:
     failed: int
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class WeekSummary:
     week_start: date
     week_end: date
@@ -69,7 +73,7 @@ class WeekSummary:
     critical_failures: int
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class MonthSummary:
     month_start: date
     month_end: date
@@ -79,13 +83,13 @@ class MonthSummary:
     level_change: str
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class WeeklyAdjustment:
     week_start: date
     adjustment_note: str
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class LevelRules:
     level: int
     active_skills: tuple[Skill, ...]
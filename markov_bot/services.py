@@ -1,11 +1,12 @@
 from __future__ import annotations
 
-import hashlib
 import random
 import uuid
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 
+from blake3 import blake3
+
 from markov_bot.domain import (
     DaySummary,
     LevelRules,
@@ -66,12 +67,14 @@ class TaskService:
         templates = [t for t in self.storage.list_templates() if t.skill in rules.active_skills]
         if not templates:
             templates = list(DEFAULT_TEMPLATES)
-        rng = self._seeded_rng(user_id, date_value)
+        day_hash = self._day_hash(user_id, date_value)
+        rng = self._seeded_rng(day_hash)
         count = rng.randint(rules.min_daily_tasks, rules.max_daily_tasks)
-        selected = rng.sample(templates, k=min(count, len(templates)))
+        rng.shuffle(templates)
+        selected = templates[:count]
         assignments = tuple(
             TaskAssignment(
-                assignment_id=self._assignment_id(user_id, date_value, template.template_id),
+                assignment_id=self._assignment_id(day_hash, template.template_id),
                 user_id=user_id,
                 template_id=template.template_id,
                 title=template.title,
@@ -84,14 +87,14 @@ class TaskService:
         self.storage.create_assignments(assignments)
         return DailyPlan(date_value=date_value, assignments=assignments)
 
-    def record_result(
+    def new_event(
         self,
         user_id: int,
         assignment_id: str,
         status: TaskStatus,
         note: str | None = None,
     ) -> TaskEvent:
-        event = TaskEvent(
+        return TaskEvent(
             event_id=str(uuid.uuid4()),
             assignment_id=assignment_id,
             user_id=user_id,
@@ -99,19 +102,29 @@ class TaskService:
             created_at=datetime.utcnow(),
             note=note,
         )
-        self.storage.record_event(event)
+
+    def record_result(
+        self,
+        user_id: int,
+        assignment_id: str,
+        status: TaskStatus,
+        note: str | None = None,
+    ) -> TaskEvent | None:
+        event = self.new_event(user_id, assignment_id, status, note)
+        if not self.storage.record_event(event):
+            return None
         return event
 
+    def record_events(self, events: list[TaskEvent]) -> list[bool]:
+        return self.storage.record_events_batch(events)
+
     def daily_summary(self, user_id: int, date_value: date) -> DaySummary:
         assignments = self.storage.list_assignments_for_date(user_id, date_value)
         return summarize_day(assignments)
 
     def weekly_summary(self, user_id: int, week_start: date) -> WeekSummary:
         week_end = week_start + timedelta(days=6)
-        assignments = self.storage.list_assignments_between(user_id, week_start, week_end)
-        done = sum(1 for item in assignments if item.status == TaskStatus.DONE)
-        failed = sum(1 for item in assignments if item.status == TaskStatus.FAILED)
-        total = len(assignments)
+        total, done, failed = self.storage.summarize_between(user_id, week_start, week_end)
         completion = completion_rate(done, total)
         overload_flag = total > 7 * DEFAULT_RULES.max_daily_tasks
         stagnation_flag = done == 0 and total > 0
@@ -138,10 +151,7 @@ class TaskService:
 
     def monthly_summary(self, user_id: int, month_start: date, level: int) -> MonthSummary:
         month_end = month_start + timedelta(days=29)
-        assignments = self.storage.list_assignments_between(user_id, month_start, month_end)
-        done = sum(1 for item in assignments if item.status == TaskStatus.DONE)
-        failed = sum(1 for item in assignments if item.status == TaskStatus.FAILED)
-        total = len(assignments)
+        total, done, failed = self.storage.summarize_between(user_id, month_start, month_end)
         completion = completion_rate(done, total)
         closed_weeks = 4
         critical_failures = failed if failed >= 15 else 0
@@ -171,11 +181,16 @@ class TaskService:
         return "hold"
 
     @staticmethod
-    def _assignment_id(user_id: int, date_value: date, template_id: str) -> str:
-        raw = f"{user_id}:{date_value.isoformat()}:{template_id}".encode("utf-8")
-        return hashlib.sha256(raw).hexdigest()[:16]
+    def _day_hash(user_id: int, date_value: date) -> blake3:
+        return blake3(f"{user_id}:{date_value.isoformat()}".encode("utf-8"))
+
+    @staticmethod
+    def _assignment_id(day_hash: blake3, template_id: str) -> str:
+        digest = day_hash.copy()
+        digest.update(f":{template_id}".encode("utf-8"))
+        return digest.hexdigest(length=8)
 
     @staticmethod
-    def _seeded_rng(user_id: int, date_value: date) -> random.Random:
-        seed = int(hashlib.sha256(f"{user_id}:{date_value.isoformat()}".encode()).hexdigest(), 16)
+    def _seeded_rng(day_hash: blake3) -> random.Random:
+        seed = int.from_bytes(day_hash.digest(length=8), "big")
         return random.Random(seed)
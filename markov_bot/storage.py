@@ -1,29 +1,136 @@
 from __future__ import annotations
 
 import sqlite3
+import threading
 from contextlib import contextmanager
 from datetime import date, datetime
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 
-from markov_bot.domain import Skill, TaskAssignment, TaskEvent, TaskStatus, TaskTemplate
+from cachetools import TTLCache
+
+from markov_bot.domain import (
+    SKILL_BY_VALUE,
+    STATUS_BY_VALUE,
+    TaskAssignment,
+    TaskEvent,
+    TaskStatus,
+    TaskTemplate,
+)
+
+_ASSIGNMENT_COLUMNS = "assignment_id, user_id, template_id, title, skill, date_assigned, status"
+_READ_CACHE_SIZE = 1024
+_READ_CACHE_TTL = 10
+
+_CachedRead = tuple[TaskAssignment, ...] | tuple[int, int, int]
+
+SQL_INSERT_USER = "INSERT OR IGNORE INTO users(user_id, created_at) VALUES (?, ?)"
+SQL_UPSERT_TEMPLATE = """
+    INSERT INTO task_templates(template_id, skill, title, min_minutes, max_minutes)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(template_id) DO UPDATE SET
+        skill=excluded.skill,
+        title=excluded.title,
+        min_minutes=excluded.min_minutes,
+        max_minutes=excluded.max_minutes
+"""
+SQL_LIST_TEMPLATES = "SELECT template_id, skill, title, min_minutes, max_minutes FROM task_templates"
+SQL_INSERT_ASSIGNMENT = f"""
+    INSERT INTO task_assignments({_ASSIGNMENT_COLUMNS})
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_INSERT_EVENT = """
+    INSERT INTO task_events(event_id, assignment_id, user_id, status, created_at, note)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+SQL_UPDATE_STATUS = "UPDATE task_assignments SET status = ? WHERE assignment_id = ?"
+SQL_UPDATE_STATUS_OWNED = (
+    "UPDATE task_assignments SET status = ? WHERE assignment_id = ? AND user_id = ?"
+)
+SQL_LIST_BY_DATE = f"""
+    SELECT {_ASSIGNMENT_COLUMNS} FROM task_assignments
+    WHERE user_id = ? AND date_assigned = ?
+    ORDER BY assignment_id
+"""
+SQL_LIST_BETWEEN = f"""
+    SELECT {_ASSIGNMENT_COLUMNS} FROM task_assignments
+    WHERE user_id = ? AND date_assigned BETWEEN ? AND ?
+    ORDER BY date_assigned, assignment_id
+"""
+SQL_SUMMARIZE_BETWEEN = """
+    SELECT
+        COUNT(*),
+        COALESCE(SUM(status = ?), 0),
+        COALESCE(SUM(status = ?), 0)
+    FROM task_assignments
+    WHERE user_id = ? AND date_assigned BETWEEN ? AND ?
+"""
+SQL_FETCH_ASSIGNMENT = f"SELECT {_ASSIGNMENT_COLUMNS} FROM task_assignments WHERE assignment_id = ?"
 
 
 class Storage:
     def __init__(self, db_path: str) -> None:
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._templates_cache: tuple[TaskTemplate, ...] | None = None
+        self._known_users: set[int] = set()
+        self._cache_lock = threading.Lock()
+        self._read_cache: TTLCache[int, dict[tuple[str, ...], _CachedRead]] = TTLCache(
+            maxsize=_READ_CACHE_SIZE, ttl=_READ_CACHE_TTL
+        )
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA mmap_size=134217728")
         self._init_db()
 
     @contextmanager
     def _connect(self) -> Iterable[sqlite3.Connection]:
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        try:
-            yield conn
-            conn.commit()
-        finally:
-            conn.close()
+        with self._lock:
+            try:
+                yield self._conn
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _cached_read(self, user_id: int, key: tuple[str, ...]) -> _CachedRead | None:
+        with self._cache_lock:
+            entries = self._read_cache.get(user_id)
+            if entries is None:
+                return None
+            return entries.get(key)
+
+    def _store_read(self, user_id: int, key: tuple[str, ...], value: _CachedRead) -> None:
+        with self._cache_lock:
+            entries = self._read_cache.get(user_id)
+            if entries is None:
+                entries = {}
+                self._read_cache[user_id] = entries
+            entries[key] = value
+
+    def _invalidate_reads(self, user_id: int | None = None) -> None:
+        with self._cache_lock:
+            if user_id is None:
+                self._read_cache.clear()
+            else:
+                self._read_cache.pop(user_id, None)
+
+    @staticmethod
+    def _update_status_owned(
+        conn: sqlite3.Connection,
+        assignment_id: str,
+        user_id: int,
+        status: TaskStatus,
+    ) -> bool:
+        cursor = conn.execute(SQL_UPDATE_STATUS_OWNED, (status.value, assignment_id, user_id))
+        return cursor.rowcount > 0
 
     def _init_db(self) -> None:
         with self._connect() as conn:
@@ -63,28 +170,26 @@ class Storage:
                     note TEXT,
                     FOREIGN KEY(assignment_id) REFERENCES task_assignments(assignment_id)
                 );
+
+                CREATE INDEX IF NOT EXISTS idx_assignments_user_date
+                    ON task_assignments(user_id, date_assigned);
+
+                CREATE INDEX IF NOT EXISTS idx_events_assignment
+                    ON task_events(assignment_id);
                 """
             )
 
     def ensure_user(self, user_id: int) -> None:
+        if user_id in self._known_users:
+            return
         with self._connect() as conn:
-            conn.execute(
-                "INSERT OR IGNORE INTO users(user_id, created_at) VALUES (?, ?)",
-                (user_id, datetime.utcnow().isoformat()),
-            )
+            conn.execute(SQL_INSERT_USER, (user_id, datetime.utcnow().isoformat()))
+        self._known_users.add(user_id)
 
     def upsert_template(self, template: TaskTemplate) -> None:
         with self._connect() as conn:
             conn.execute(
-                """
-                INSERT INTO task_templates(template_id, skill, title, min_minutes, max_minutes)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(template_id) DO UPDATE SET
-                    skill=excluded.skill,
-                    title=excluded.title,
-                    min_minutes=excluded.min_minutes,
-                    max_minutes=excluded.max_minutes
-                """,
+                SQL_UPSERT_TEMPLATE,
                 (
                     template.template_id,
                     template.skill.value,
@@ -93,87 +198,96 @@ class Storage:
                     template.max_minutes,
                 ),
             )
+        self._templates_cache = None
 
     def list_templates(self) -> list[TaskTemplate]:
+        if self._templates_cache is not None:
+            return list(self._templates_cache)
         with self._connect() as conn:
-            rows = conn.execute("SELECT * FROM task_templates").fetchall()
-        return [
+            rows = conn.execute(SQL_LIST_TEMPLATES).fetchall()
+        self._templates_cache = tuple(
             TaskTemplate(
-                template_id=row["template_id"],
-                skill=Skill(row["skill"]),
-                title=row["title"],
-                min_minutes=row["min_minutes"],
-                max_minutes=row["max_minutes"],
+                template_id=template_id,
+                skill=SKILL_BY_VALUE[skill],
+                title=title,
+                min_minutes=min_minutes,
+                max_minutes=max_minutes,
             )
-            for row in rows
-        ]
+            for template_id, skill, title, min_minutes, max_minutes in rows
+        )
+        return list(self._templates_cache)
 
     def create_assignments(self, assignments: Iterable[TaskAssignment]) -> None:
+        user_ids: set[int] = set()
+
+        def rows() -> Iterator[tuple[str, int, str, str, str, str, str]]:
+            for assignment in assignments:
+                user_ids.add(assignment.user_id)
+                yield (
+                    assignment.assignment_id,
+                    assignment.user_id,
+                    assignment.template_id,
+                    assignment.title,
+                    assignment.skill.value,
+                    assignment.date_assigned.isoformat(),
+                    assignment.status.value,
+                )
+
         with self._connect() as conn:
-            conn.executemany(
-                """
-                INSERT INTO task_assignments(
-                    assignment_id, user_id, template_id, title, skill, date_assigned, status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                [
-                    (
-                        assignment.assignment_id,
-                        assignment.user_id,
-                        assignment.template_id,
-                        assignment.title,
-                        assignment.skill.value,
-                        assignment.date_assigned.isoformat(),
-                        assignment.status.value,
-                    )
-                    for assignment in assignments
-                ],
-            )
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(SQL_INSERT_ASSIGNMENT, rows())
+            for user_id in user_ids:
+                self._invalidate_reads(user_id)
+
+    def record_event(self, event: TaskEvent) -> bool:
+        return self.record_events_batch([event])[0]
 
-    def record_event(self, event: TaskEvent) -> None:
+    def record_events_batch(self, events: list[TaskEvent]) -> list[bool]:
         with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO task_events(
-                    event_id, assignment_id, user_id, status, created_at, note
-                ) VALUES (?, ?, ?, ?, ?, ?)
-                """,
+            accepted = [
+                self._update_status_owned(conn, event.assignment_id, event.user_id, event.status)
+                for event in events
+            ]
+            conn.executemany(
+                SQL_INSERT_EVENT,
                 (
-                    event.event_id,
-                    event.assignment_id,
-                    event.user_id,
-                    event.status.value,
-                    event.created_at.isoformat(),
-                    event.note,
+                    (
+                        event.event_id,
+                        event.assignment_id,
+                        event.user_id,
+                        event.status.value,
+                        event.created_at.isoformat(),
+                        event.note,
+                    )
+                    for event, ok in zip(events, accepted)
+                    if ok
                 ),
             )
-            conn.execute(
-                "UPDATE task_assignments SET status = ? WHERE assignment_id = ?",
-                (event.status.value, event.assignment_id),
-            )
+            for user_id in {event.user_id for event, ok in zip(events, accepted) if ok}:
+                self._invalidate_reads(user_id)
+        return accepted
 
     def list_assignments_for_date(self, user_id: int, date_value: date) -> list[TaskAssignment]:
+        key = ("day", date_value.isoformat())
+        cached = self._cached_read(user_id, key)
+        if cached is not None:
+            return list(cached)
         with self._connect() as conn:
-            rows = conn.execute(
-                """
-                SELECT * FROM task_assignments
-                WHERE user_id = ? AND date_assigned = ?
-                ORDER BY assignment_id
-                """,
-                (user_id, date_value.isoformat()),
-            ).fetchall()
-        return [
-            TaskAssignment(
-                assignment_id=row["assignment_id"],
-                user_id=row["user_id"],
-                template_id=row["template_id"],
-                title=row["title"],
-                skill=Skill(row["skill"]),
-                date_assigned=date.fromisoformat(row["date_assigned"]),
-                status=TaskStatus(row["status"]),
+            rows = conn.execute(SQL_LIST_BY_DATE, (user_id, key[1])).fetchall()
+            assignments = tuple(
+                TaskAssignment(
+                    assignment_id=assignment_id,
+                    user_id=row_user_id,
+                    template_id=template_id,
+                    title=title,
+                    skill=SKILL_BY_VALUE[skill],
+                    date_assigned=date.fromisoformat(date_assigned),
+                    status=STATUS_BY_VALUE[status],
+                )
+                for assignment_id, row_user_id, template_id, title, skill, date_assigned, status in rows
             )
-            for row in rows
-        ]
+            self._store_read(user_id, key, assignments)
+        return list(assignments)
 
     def list_assignments_between(
         self,
@@ -183,47 +297,65 @@ class Storage:
     ) -> list[TaskAssignment]:
         with self._connect() as conn:
             rows = conn.execute(
-                """
-                SELECT * FROM task_assignments
-                WHERE user_id = ? AND date_assigned BETWEEN ? AND ?
-                ORDER BY date_assigned, assignment_id
-                """,
+                SQL_LIST_BETWEEN,
                 (user_id, start_date.isoformat(), end_date.isoformat()),
             ).fetchall()
         return [
             TaskAssignment(
-                assignment_id=row["assignment_id"],
-                user_id=row["user_id"],
-                template_id=row["template_id"],
-                title=row["title"],
-                skill=Skill(row["skill"]),
-                date_assigned=date.fromisoformat(row["date_assigned"]),
-                status=TaskStatus(row["status"]),
+                assignment_id=assignment_id,
+                user_id=row_user_id,
+                template_id=template_id,
+                title=title,
+                skill=SKILL_BY_VALUE[skill],
+                date_assigned=date.fromisoformat(date_assigned),
+                status=STATUS_BY_VALUE[status],
             )
-            for row in rows
+            for assignment_id, row_user_id, template_id, title, skill, date_assigned, status in rows
         ]
 
+    def summarize_between(self, user_id: int, start_date: date, end_date: date) -> tuple[int, int, int]:
+        key = ("summary", start_date.isoformat(), end_date.isoformat())
+        cached = self._cached_read(user_id, key)
+        if cached is not None:
+            return cached
+        with self._connect() as conn:
+            row = conn.execute(
+                SQL_SUMMARIZE_BETWEEN,
+                (TaskStatus.DONE.value, TaskStatus.FAILED.value, user_id, key[1], key[2]),
+            ).fetchone()
+            summary = (row[0], row[1], row[2])
+            self._store_read(user_id, key, summary)
+        return summary
+
     def update_assignment_status(self, assignment_id: str, status: TaskStatus) -> None:
         with self._connect() as conn:
-            conn.execute(
-                "UPDATE task_assignments SET status = ? WHERE assignment_id = ?",
-                (status.value, assignment_id),
-            )
+            conn.execute(SQL_UPDATE_STATUS, (status.value, assignment_id))
+            self._invalidate_reads()
+
+    def update_assignment_status_owned(
+        self,
+        assignment_id: str,
+        user_id: int,
+        status: TaskStatus,
+    ) -> bool:
+        with self._connect() as conn:
+            if not self._update_status_owned(conn, assignment_id, user_id, status):
+                return False
+            self._invalidate_reads(user_id)
+        return True
 
     def fetch_assignment(self, assignment_id: str) -> TaskAssignment | None:
         with self._connect() as conn:
-            row = conn.execute(
-                "SELECT * FROM task_assignments WHERE assignment_id = ?",
-                (assignment_id,),
-            ).fetchone()
+            row = conn.execute(SQL_FETCH_ASSIGNMENT, (assignment_id,)).fetchone()
         if not row:
             return None
+        _, user_id, template_id, title, skill, date_assigned, status = row
         return TaskAssignment(
-            assignment_id=row["assignment_id"],
-            user_id=row["user_id"],
-            template_id=row["template_id"],
-            title=row["title"],
-            skill=Skill(row["skill"]),
-            date_assigned=date.fromisoformat(row["date_assigned"]),
-            status=TaskStatus(row["status"]),
+            assignment_id=assignment_id,
+            user_id=user_id,
+            template_id=template_id,
+            title=title,
+            skill=SKILL_BY_VALUE[skill],
+            date_assigned=date.fromisoformat(date_assigned),
+            status=STATUS_BY_VALUE[status],
         )